@@ -1,23 +1,95 @@
 import os
+import errno
+import shutil
 import argparse
 import traceback
 import time
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Event
+import tempfile
+import re
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Event, Lock, Thread
+from collections import deque
 from tqdm import tqdm
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from src.spotify_fetcher import fetch_playlist
 from src.metadata_cleaner import clean_metadata
 from src.search_engine import build_query
 from src.downloader import download_audio
+from src.encoder import kill_running
 from src.tagger import tag_audio
 from src.utils import process_cover, sanitize_filename
+from src.config import SPOTIFY_CONFIG_PATH, YTMUSIC_CONFIG_PATH, load_config
+
+OUTPUT_DIR = os.path.join("output", "playlist")
+COVER_DIR = os.path.join("assets", "covers")
+_TRACK_PREFIX_RE = re.compile(r"^\d+ - ")
+
+
+AUTH_CACHE_PATH = os.path.join("config", ".auth_cache.json")
+AUTH_CACHE_TTL = 3600  # 1 jam
+
+
+def _auth_cache_hit(config_path):
+    """True if config_path passed a live auth probe within the TTL and is unchanged since"""
+    try:
+        with open(AUTH_CACHE_PATH, 'r') as f:
+            entry = json.load(f).get(config_path)
+        return (
+            entry is not None
+            and entry.get("mtime") == os.path.getmtime(config_path)
+            and time.time() - entry.get("ts", 0) < AUTH_CACHE_TTL
+        )
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def _auth_cache_store(config_path):
+    """Record a successful live auth probe for config_path"""
+    try:
+        with open(AUTH_CACHE_PATH, 'r') as f:
+            cache = json.load(f)
+        if not isinstance(cache, dict):
+            cache = {}
+    except (OSError, ValueError):
+        cache = {}
+    try:
+        cache[config_path] = {"ts": time.time(), "mtime": os.path.getmtime(config_path)}
+        with open(AUTH_CACHE_PATH, 'w') as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+
+@contextmanager
+def _oauth_file(oauth_config):
+    """Yield a private (0600) temp oauth.json for ytmusicapi; removed again on exit.
+
+    The tokens are never left behind in the shared temp directory, and a failed
+    write cannot leave a truncated file for a later run to pick up.
+    """
+    fd, path = tempfile.mkstemp(prefix="spdl_oauth_", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(oauth_config, f)
+        yield path
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
 
 def validate_spotify_auth():
     """Validate Spotify authentication configuration"""
-    config_path = "config/spotify.json"
+    config_path = SPOTIFY_CONFIG_PATH
 
     if not os.path.exists(config_path):
         print("ERROR: Spotify config not found!")
@@ -26,8 +98,7 @@ def validate_spotify_auth():
         return False
 
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        config = load_config(config_path)
 
         # Check if config has required fields
         required_fields = ['client_id', 'client_secret']
@@ -86,15 +157,20 @@ def validate_ytmusic_auth():
     """Validate YTMusic authentication configuration"""
 
     # First check for headers format (preferred working method)
-    if os.path.exists("config/headers_auth.json"):
+    headers_path = "config/headers_auth.json"
+    if os.path.exists(headers_path):
+        if _auth_cache_hit(headers_path):
+            print("YouTube Music authentication: OK (headers format, cached)")
+            return True
         try:
             from ytmusicapi import YTMusic
 
             # Test headers authentication
-            ytmusic = YTMusic("config/headers_auth.json")
+            ytmusic = YTMusic(headers_path)
             test_results = ytmusic.search("test", filter='songs', limit=1)
 
             if test_results:
+                _auth_cache_store(headers_path)
                 print("YouTube Music authentication: OK (headers format)")
                 return True
             else:
@@ -108,7 +184,7 @@ def validate_ytmusic_auth():
             return False
 
     # Then check for ytmusic.json config
-    config_path = "config/ytmusic.json"
+    config_path = YTMUSIC_CONFIG_PATH
 
     if not os.path.exists(config_path):
         print("ERROR: YTMusic config not found!")
@@ -116,8 +192,7 @@ def validate_ytmusic_auth():
         return False
 
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        config = load_config(config_path)
 
         # Check if config has required fields
         if 'oauth_credentials' in config:
@@ -138,6 +213,10 @@ def validate_ytmusic_auth():
                     print("Please run: python setup_oauth.py")
                     return False
 
+            if _auth_cache_hit(config_path):
+                print("YouTube Music authentication: OK (OAuth, cached)")
+                return True
+
             # Test OAuth authentication
             try:
                 from ytmusicapi import YTMusic
@@ -151,54 +230,25 @@ def validate_ytmusic_auth():
                     "scope": oauth['scope']
                 }
 
-                # Save temporary oauth.json for ytmusicapi
-                import tempfile
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-                    json.dump(oauth_config, f)
-                    temp_oauth_file = f.name
-
-                try:
-                    ytmusic = YTMusic(temp_oauth_file)
+                # Temporary oauth.json for ytmusicapi, kept until the test search is done
+                with _oauth_file(oauth_config) as oauth_path:
+                    ytmusic = YTMusic(oauth_path)
 
                     # Test search
                     test_results = ytmusic.search("test", filter='songs', limit=1)
-                    if test_results:
-                        print("YouTube Music authentication: OK (OAuth)")
-                        return True
-                    else:
-                        print("ERROR: YTMusic OAuth test failed")
-                        print("Please run: python setup_oauth.py")
-                        return False
-                finally:
-                    # Clean up temp file
-                    os.unlink(temp_oauth_file)
-
-            except Exception as e:
-                error_msg = str(e)
-                print(f"ERROR: YTMusic OAuth authentication failed: {e}")
-                print("Please run: python setup_oauth.py")
-                return False
-
-        # Check for headers format (alternative authentication)
-        elif os.path.exists("config/headers_auth.json"):
-            try:
-                from ytmusicapi import YTMusic
-
-                # Test headers authentication
-                ytmusic = YTMusic("config/headers_auth.json")
-                test_results = ytmusic.search("test", filter='songs', limit=1)
-
                 if test_results:
-                    print("YouTube Music authentication: OK (headers format)")
+                    _auth_cache_store(config_path)
+                    print("YouTube Music authentication: OK (OAuth)")
                     return True
                 else:
-                    print("ERROR: YTMusic headers test failed")
-                    print("Please configure YTMusic authentication manually.")
+                    print("ERROR: YTMusic OAuth test failed")
+                    print("Please run: python setup_oauth.py")
                     return False
 
             except Exception as e:
-                print(f"ERROR: YTMusic headers authentication failed: {e}")
-                print("Please configure YTMusic authentication manually.")
+                error_msg = str(e)
+                print(f"ERROR: YTMusic OAuth authentication failed: {e}")
+                print("Please run: python setup_oauth.py")
                 return False
 
         elif 'cookies' in config:
@@ -245,6 +295,65 @@ def validate_ytmusic_auth():
         return False
 
 
+def cover_path(track_number):
+    return f"{COVER_DIR}{os.sep}{track_number}.jpg"
+
+
+def move_file(src, dst):
+    """Move src to dst with a single rename, copying only across filesystems."""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+# Antrian log: worker cukup append, satu thread yang menulis ke tqdm per batch
+_log_queue = deque()
+# Pop dan write dalam satu lock, supaya urutan baris tetap sama dengan urutan append
+_log_flush_lock = Lock()
+_log_writer_stop = None
+_log_writer_thread = None
+
+
+def _flush_log_queue():
+    with _log_flush_lock:
+        batch = []
+        while True:
+            try:
+                batch.append(_log_queue.popleft())
+            except IndexError:
+                break
+        if batch:
+            tqdm.write("\n".join(batch))
+
+
+def _log_writer_loop(stop, interval):
+    while not stop.wait(interval):
+        _flush_log_queue()
+    _flush_log_queue()
+
+
+def start_log_writer(interval=0.2):
+    """Start the background thread that flushes queued log lines every interval seconds"""
+    global _log_writer_stop, _log_writer_thread
+    _log_writer_stop = Event()
+    _log_writer_thread = Thread(target=_log_writer_loop, args=(_log_writer_stop, interval), daemon=True)
+    _log_writer_thread.start()
+
+
+def stop_log_writer():
+    """Stop the log writer thread, wait for its last batch, and flush anything still queued"""
+    global _log_writer_stop, _log_writer_thread
+    if _log_writer_stop is not None:
+        _log_writer_stop.set()
+        _log_writer_thread.join()
+        _log_writer_stop = None
+        _log_writer_thread = None
+    _flush_log_queue()
+
+
 def log_message(message, level="INFO", track_number=None, quiet=False):
     """
     Fungsi untuk mencetak pesan log dengan format minimalis
@@ -258,7 +367,10 @@ def log_message(message, level="INFO", track_number=None, quiet=False):
     else:
         formatted_msg = f"{message}"
 
-    tqdm.write(formatted_msg)
+    _log_queue.append(formatted_msg)
+    if level == "ERROR" or _log_writer_stop is None:
+        # Errors (and logging outside a run) go out immediately, after anything queued
+        _flush_log_queue()
 
 
 def process_track(
@@ -269,84 +381,100 @@ def process_track(
     use_official=True,
     search_count=5,
     stop_event=None,
+    existing_index=None,
+    cover_futures=None,
+    audio_cache=None,
 ):
-    if stop_event is not None and stop_event.is_set():
-        raise KeyboardInterrupt()
-
     start_time = time.time()
-    log_message(f"Downloading {t['artist']} - {t['title']}", "INFO", t['track_number'], quiet)
+    log_message(f"Downloading {t.artist} - {t.title}", "INFO", t.track_number, quiet)
     
-    base = f'{t["track_number"]:02d} - {t["artist"]} - {t["title"]}'
-    safe_base = sanitize_filename(base)
+    # Sanitize "artist - title" once; the "NN - " prefix has no unsafe characters
+    safe_artist_title = sanitize_filename(f"{t.artist} - {t.title}")
+    safe_base = f'{t.track_number:02d} - {safe_artist_title}'
     outfilename = f"{safe_base}.mp3"
-    mp3 = os.path.join("output", "playlist", outfilename)
-    cover = f'assets/covers/{t["track_number"]}.jpg'
-
-    # Check for existing file
-    if not force:
-        search_key = sanitize_filename(f"{t['artist']} - {t['title']}")
-        existing = None
-        if os.path.exists("output/playlist"):
-            for fname in os.listdir("output/playlist"):
-                if search_key.lower() in fname.lower():
-                    candidate = os.path.join("output/playlist", fname)
-                    try:
-                        if os.path.getsize(candidate) > 1024:
-                            existing = candidate
-                            break
-                    except OSError:
-                        continue
+    mp3 = f"{OUTPUT_DIR}{os.sep}{outfilename}"
+    cover = cover_path(t.track_number)
+
+    # Check for existing file (directory index is built once in main())
+    if not force and existing_index:
+        existing = existing_index.get(safe_artist_title.lower())
         if existing:
-            log_message(f"Skipped: {os.path.basename(existing)}", "SKIP", t['track_number'], quiet)
-            return (t["track_number"], True, "skipped")
+            # Drop the prefetched cover; skipped tracks are never tagged
+            if cover_futures is not None and not cover_futures[t.track_number].cancel():
+                try:
+                    cover_futures[t.track_number].result()
+                    os.remove(cover)
+                except Exception:
+                    pass
+            log_message(f"Skipped: {existing}", "SKIP", t.track_number, quiet)
+            return (t.track_number, True, "skipped")
 
     try:
-        process_cover(t["cover_url"], cover)
+        if cover_futures is not None:
+            # Cover was prefetched in main(); just wait for (or re-raise) its result
+            cover_futures[t.track_number].result()
+        else:
+            process_cover(t.cover_url, cover)
         q = build_query(t, use_official=use_official)
-        
+
+        # Cancellation point before the long network phase (download_audio checks per candidate)
+        if stop_event is not None and stop_event.is_set():
+            raise KeyboardInterrupt()
+
         # Alur Langsung: Download menghasilkan MP3 192kbps
         download_audio(
             q,
             mp3,
-            artist=t.get("artist"),
-            title=t.get("title"),
-            duration_ms=t.get("duration_ms"),
-            isrc=t.get("isrc"),
-            album=t.get("album"),
+            artist=t.artist,
+            title=t.title,
+            duration_ms=t.duration_ms,
+            isrc=t.isrc,
+            album=t.album,
             verbose=verbose,
             search_count=search_count,
             stop_event=stop_event,
+            # --force means a fresh download, so it bypasses the audio cache too
+            cache_dir=None if force else audio_cache,
+            overwrite=force,
         )
 
-        # Verify output
-        if not (os.path.exists(mp3) and os.path.getsize(mp3) > 1024):
+        # Verify output (single stat)
+        try:
+            mp3_size = os.stat(mp3).st_size
+        except FileNotFoundError:
+            mp3_size = 0
+        if mp3_size <= 1024:
             raise RuntimeError(f"Downloaded audio missing or invalid: {mp3}")
 
         # Tagging
-        log_message(f"Tagging {os.path.basename(mp3)}", "PROGRESS", t['track_number'], quiet)
-        tag_audio(mp3, t, cover)
+        log_message(f"Tagging {os.path.basename(mp3)}", "PROGRESS", t.track_number, quiet)
+        tag_audio(mp3, t._asdict(), cover)
         
         try:
-            if os.path.exists(cover):
-                os.remove(cover)
+            os.remove(cover)
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            log_message(f"Warning: Could not remove cover {os.path.basename(cover)}", "WARNING", t['track_number'], quiet)
+            log_message(f"Warning: Could not remove cover {os.path.basename(cover)}", "WARNING", t.track_number, quiet)
 
         duration = time.time() - start_time
-        log_message(f"Completed {t['artist']} - {t['title']}", "SUCCESS", t['track_number'], quiet)
+        log_message(f"Completed {t.artist} - {t.title}", "SUCCESS", t.track_number, quiet)
 
         return (
-            t["track_number"],
+            t.track_number,
             True,
             {"mp3": mp3, "meta": t, "cover": cover, "skipped": False},
         )
     except Exception as e:
         try:
-            if os.path.exists(mp3):
-                os.remove(mp3)
-        except:
+            os.remove(mp3)
+        except OSError:
             pass
-        return (t["track_number"], False, str(e) + "\n" + traceback.format_exc())
+        # Full traceback only when asked for; the summary line is all main() shows
+        info = str(e) or repr(e)
+        if verbose:
+            info += "\n" + traceback.format_exc()
+        return (t.track_number, False, info)
 
 
 def main():
@@ -356,8 +484,12 @@ def main():
         "-w",
         "--workers",
         type=int,
-        default=3,
-        help="download worker threads (default: 3)",
+        default=os.environ.get("SPDL_WORKERS", "16"),
+        help=(
+            "download worker threads (default: $SPDL_WORKERS or 16). Downloads are "
+            "network-bound, so more workers raise throughput, but very high values "
+            "can trigger YouTube rate limiting"
+        ),
     )
     parser.add_argument("--quiet", action="store_true", help="less verbose output")
     parser.add_argument(
@@ -377,6 +509,15 @@ def main():
         default=5,
         help="number of search candidates to evaluate (default: 5)",
     )
+    parser.add_argument(
+        "--audio-cache",
+        default=os.environ.get("SPDL_AUDIO_CACHE"),
+        metavar="DIR",
+        help=(
+            "keep finished downloads in DIR and reuse them on later runs "
+            "(default: $SPDL_AUDIO_CACHE, disabled if unset)"
+        ),
+    )
 
     args = parser.parse_args()
 
@@ -395,61 +536,96 @@ def main():
 
     tracks = clean_metadata(tracks)
 
-    os.makedirs("assets/covers", exist_ok=True)
-    os.makedirs("output/playlist", exist_ok=True)
+    os.makedirs(COVER_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # One scan of the output dir: finished .mp3 files over 1KB, keyed by their lowercased
+    # "artist - title" part ("NN - " prefix and extension stripped) for the per-track skip check
+    existing_index = {}
+    with os.scandir(OUTPUT_DIR) as it:
+        for entry in it:
+            name_lower = entry.name.lower()
+            if not name_lower.endswith(".mp3"):
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_size > 1024:
+                    key = _TRACK_PREFIX_RE.sub("", name_lower[:-4], count=1)
+                    existing_index[key] = entry.name
+            except OSError:
+                continue
+
+    # Prefetch all covers up front so workers don't fetch them serially before audio
+    cover_pool = ThreadPoolExecutor(max_workers=16)
+    cover_futures = {
+        t.track_number: cover_pool.submit(
+            process_cover, t.cover_url, cover_path(t.track_number)
+        )
+        for t in tracks
+    }
 
     stop_event = Event()
     failures = []
 
+    start_log_writer()
+
+    worker = partial(
+        process_track,
+        quiet=args.quiet,
+        verbose=args.verbose,
+        force=args.force,
+        use_official=not args.no_official,
+        search_count=args.search_count,
+        stop_event=stop_event,
+        existing_index=existing_index,
+        cover_futures=cover_futures,
+        audio_cache=args.audio_cache,
+    )
+
     with ThreadPoolExecutor(max_workers=args.workers) as ex:
-        futures = {
-            ex.submit(
-                process_track,
-                t,
-                args.quiet,
-                args.verbose,
-                args.force,
-                not args.no_official,
-                args.search_count,
-                stop_event,
-            ): t
-            for t in tracks
-        }
+        futures = {ex.submit(worker, t): t for t in tracks}
 
         with tqdm(total=len(tracks), desc="Tracks", unit="track") as pbar:
             try:
-                for fut in as_completed(futures):
-                    try:
-                        tn, ok, info = fut.result()
-                    except Exception as e:
-                        log_message(f"Worker error: {e}", "ERROR", None, args.quiet)
-                        failures.append((None, str(e)))
-                        pbar.update(1)
-                        continue
-
-                    if not ok:
-                        failures.append((tn, info))
-                        log_message(f"Failed: {info.splitlines()[0] if info else 'Unknown error'}", "ERROR", tn, args.quiet)
-                    else:
-                        if info == "skipped":
-                            log_message("Skipped: Already exists", "SKIP", tn, args.quiet)
+                pending = set(futures)
+                while pending:
+                    # Handle everything that finished since the last wakeup, with one
+                    # progress-bar update. The timeout is for Ctrl+C, not batching: on
+                    # Windows an untimed wait() blocks KeyboardInterrupt until some track
+                    # completes, so the main thread wakes at least every 0.5s
+                    done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        try:
+                            tn, ok, info = fut.result()
+                        except Exception as e:
+                            tn, ok, info = None, False, f"Worker error: {e}"
+
+                        if not ok:
+                            failures.append((tn, info))
+                            log_message(f"Failed: {info.splitlines()[0] if info else 'Unknown error'}", "ERROR", tn, args.quiet)
                         else:
-                            log_message("Completed", "SUCCESS", tn, args.quiet)
-                    pbar.update(1)
+                            if info == "skipped":
+                                log_message("Skipped: Already exists", "SKIP", tn, args.quiet)
+                            else:
+                                log_message("Completed", "SUCCESS", tn, args.quiet)
+                    if done:
+                        pbar.update(len(done))
             except KeyboardInterrupt:
                 log_message("Interrupted by user, cancelling pending tasks...", "INFO", None, args.quiet)
                 stop_event.set()
-                for f in futures:
-                    f.cancel()
-                ex.shutdown(wait=False)
+                kill_running()
+                ex.shutdown(wait=False, cancel_futures=True)
+                cover_pool.shutdown(wait=False, cancel_futures=True)
+                stop_log_writer()
                 return
 
+    cover_pool.shutdown(wait=False)
+    stop_log_writer()
+
     total_tracks = len(tracks)
     successful_tracks = total_tracks - len(failures)
 
     if failures:
         print(f"\n{successful_tracks}/{total_tracks} tracks completed, {len(failures)} failed.")
-        import json
         failed_tracks_log = []
         for tn, err in failures:
             failed_tracks_log.append({
@@ -457,42 +633,76 @@ def main():
                 'error': str(err),
                 'timestamp': time.time()
             })
-        with open('failed_tracks.json', 'w', encoding='utf-8') as f:
-            json.dump(failed_tracks_log, f, indent=2, ensure_ascii=False)
+        if orjson is not None:
+            data = orjson.dumps(failed_tracks_log, option=orjson.OPT_INDENT_2)
+        else:
+            data = json.dumps(failed_tracks_log, indent=2, ensure_ascii=False).encode("utf-8")
+        # Write-then-rename so an interrupt never leaves a truncated log behind
+        tmp_path = 'failed_tracks.json.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, 'failed_tracks.json')
     else:
         print(f"\nAll {total_tracks} tracks completed successfully!")
-        if os.path.exists("metadata_raw.json"):
-            os.remove("metadata_raw.json")
+        try:
+            os.unlink("metadata_raw.json")
+        except FileNotFoundError:
+            pass
 
     # Move files to playlist folder
     try:
         dest_name = sanitize_filename(playlist_name) or "playlist"
         dest_dir = os.path.join("output", dest_name)
-        os.makedirs(dest_dir, exist_ok=True)
-        moved = 0
-        if os.path.exists("output/playlist"):
-            for fname in os.listdir("output/playlist"):
-                fpath = os.path.join("output/playlist", fname)
-                if fname.lower().endswith(".mp3"):
-                    dst = os.path.join(dest_dir, fname)
+        # One directory pass: names and file types come from the cached dirents
+        try:
+            with os.scandir(OUTPUT_DIR) as it:
+                entries = list(it)
+        except FileNotFoundError:
+            entries = None
+
+        if entries is not None:
+            # Clean up any leftover non-mp3 files (like .webm or .part)
+            mp3s = []
+            for entry in entries:
+                if entry.name.lower().endswith(".mp3"):
+                    mp3s.append(entry)
+                    continue
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        os.remove(entry.path)
+                except:
+                    pass
+
+            renamed = False
+            if os.path.abspath(dest_dir) == os.path.abspath(OUTPUT_DIR):
+                renamed = True
+            elif not os.path.exists(dest_dir):
+                # The staging dir only holds this run's output: rename it whole
+                try:
+                    os.rename(OUTPUT_DIR, dest_dir)
+                    renamed = True
+                except OSError:
+                    pass
+
+            if renamed:
+                moved = len(mp3s)
+            else:
+                os.makedirs(dest_dir, exist_ok=True)
+
+                def move_entry(entry):
+                    dst = os.path.join(dest_dir, entry.name)
                     try:
-                        import shutil
-                        shutil.move(fpath, dst)
-                        moved += 1
+                        move_file(entry.path, dst)
+                        return True
                     except Exception as e:
-                        print(f"WARNING: Failed to move {fpath} to {dst}: {e}")
-                else:
-                    # Clean up any leftover non-mp3 files (like .webm or .part)
-                    try:
-                        if os.path.isfile(fpath):
-                            os.remove(fpath)
-                    except:
-                        pass
+                        print(f"WARNING: Failed to move {entry.path} to {dst}: {e}")
+                        return False
+
+                with ThreadPoolExecutor(max_workers=8) as mover:
+                    moved = sum(mover.map(move_entry, mp3s))
             print(f"Moved {moved} tracks to {dest_dir}")
     except Exception as e:
         print(f"ERROR: Failed to move tracks to playlist folder: {e}")
-    else:
-        print(f"\n{successful_tracks} tracks completed, {len(failures)} failed.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,25 @@
+"""
+Config Loader
+Baca file config JSON sekali per proses, lalu pakai ulang hasilnya
+"""
+
+import json
+from functools import lru_cache
+
+SPOTIFY_CONFIG_PATH = "config/spotify.json"
+YTMUSIC_CONFIG_PATH = "config/ytmusic.json"
+
+
+@lru_cache(maxsize=None)
+def load_config(path: str) -> dict:
+    """Parse the JSON config at path; the result is shared, do not mutate it"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_spotify_config() -> dict:
+    return load_config(SPOTIFY_CONFIG_PATH)
+
+
+def load_ytmusic_config() -> dict:
+    return load_config(YTMUSIC_CONFIG_PATH)
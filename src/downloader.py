@@ -1,10 +1,544 @@
 import subprocess
 import os
+import sys
 import shutil
 import time
 import random
+import json
+import re
+import threading
+import urllib.parse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 
 from .smart_resolver import smart_resolve_track
+from .search_cache import SearchCache, get_search_cache
+from .encoder import encode_audio, wait_process
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    from yt_dlp import YoutubeDL
+    YT_DLP_AVAILABLE = True
+except ImportError:
+    YT_DLP_AVAILABLE = False
+
+# Non-original version indicators, matched as plain substrings. None is a prefix of
+# another, so the lookahead scan in download_audio reports each one that occurs
+INDICATORS = (
+    "official video", "sped up", "remix", "live", "acoustic", "instrumental", "cover",
+    "karaoke", "slowed", "concert", "perform", "tour", "video", "mv",
+)
+VIDEO_INDICATORS = frozenset(("video", "official video", "mv"))
+_WORD_RE = re.compile(r"\w+")
+
+
+def _get_words(s):
+    s = s.lower().replace("official audio", "").replace("official music video", "")
+    return set(_WORD_RE.findall(s))
+
+
+def _variant_key(s):
+    """Order-insensitive key for collapsing reordered query variants."""
+    return tuple(sorted(_WORD_RE.findall(s.lower().replace("official audio", ""))))
+
+
+# Each variant costs one search per prefix
+MAX_QUERY_VARIANTS = 2
+
+
+# YoutubeDL is not thread-safe; keep one instance per worker thread for searches
+_ydl_local = threading.local()
+
+# Shared pool for search fan-out. It bounds concurrent searches across all tracks,
+# and its long-lived threads keep their YoutubeDL instances warm between tracks.
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="yt-search")
+
+# ffmpeg re-encodes are CPU-bound; cap them at half the cores so network downloads
+# on the track workers keep running alongside. ffmpeg is its own process, so
+# threads are enough to drive it.
+_ENCODE_POOL = ThreadPoolExecutor(
+    max_workers=max(1, (os.cpu_count() or 2) // 2), thread_name_prefix="ffmpeg"
+)
+
+
+_TOOL_NAMES = ("yt-dlp", "deno", "node")
+
+
+@lru_cache(maxsize=1)
+def _probe_tools(path_env):
+    """Map each of _TOOL_NAMES to its first executable on path_env (like shutil.which).
+
+    One scandir per PATH directory answers every probe; cached per PATH value.
+    """
+    if os.name == "nt":
+        exts = [e.lower() for e in os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD").split(os.pathsep) if e]
+    else:
+        exts = [""]
+    wanted = {name + ext: name for name in _TOOL_NAMES for ext in exts}
+
+    found = {}
+    for d in path_env.split(os.pathsep):
+        if not d or len(found) == len(_TOOL_NAMES):
+            continue
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    name = wanted.get(e.name.lower() if os.name == "nt" else e.name)
+                    if name is None or name in found:
+                        continue
+                    if e.is_file() and os.access(e.path, os.X_OK):
+                        found[name] = e.path
+        except OSError:
+            continue
+    return found
+
+
+@lru_cache(maxsize=4)
+def _base_cmd(path_env, cookies_arg):
+    """Build the yt-dlp argv prefix shared by every search and download.
+
+    Returns (cmd, js_runtime); cmd is None when yt-dlp is unavailable. Cached, so the
+    tool probe and argv assembly happen once per PATH/cookies combination.
+    """
+    tools = _probe_tools(path_env)
+    js_runtime = None
+    for name in ("deno", "node"):
+        path = tools.get(name)
+        if path:
+            js_runtime = (name, path)
+            break
+
+    yt_dlp_path = tools.get("yt-dlp")
+    if yt_dlp_path is not None:
+        cmd = [yt_dlp_path]
+    elif YT_DLP_AVAILABLE:
+        # Python module method
+        cmd = [sys.executable, "-m", "yt_dlp"]
+    else:
+        return None, js_runtime
+
+    # Add cookies argument
+    cmd += list(cookies_arg)
+
+    # Add JavaScript challenge solver with Node.js (DISABLED - causes issues)
+    # cmd += ["--remote-components", "ejs:github"]
+
+    # MP3 conversion is not done by yt-dlp: downloads save the raw bestaudio stream
+    # and _encode_to_mp3 runs ffmpeg on the encode pool
+
+    # Add fallback option without JavaScript challenge
+    cmd += ["--no-check-certificate"]
+
+    # JS runtime for YouTube's challenge solver; without one found on PATH, let yt-dlp
+    # look for node itself
+    if js_runtime:
+        cmd += ["--js-runtimes", f"{js_runtime[0]}:{js_runtime[1]}"]
+    else:
+        cmd += ["--js-runtimes", "node"]
+    return tuple(cmd), js_runtime
+
+
+def _get_ydl(cookies_file=None, js_runtime=None):
+    """Return this thread's YoutubeDL instance for searches and metadata lookups."""
+    ydl = getattr(_ydl_local, "ydl", None)
+    if ydl is None:
+        opts = {
+            "quiet": True,
+            "no_warnings": True,
+            "skip_download": True,
+            "extract_flat": "in_playlist",
+            "nocheckcertificate": True,
+        }
+        if cookies_file:
+            opts["cookiefile"] = cookies_file
+        else:
+            opts["username"] = "oauth2"
+            opts["password"] = ""
+        if js_runtime:
+            opts["js_runtimes"] = {js_runtime[0]: {"path": js_runtime[1]}}
+        ydl = YoutubeDL(opts)
+        _ydl_local.ydl = ydl
+    return ydl
+
+
+def _find_raw_download(base_path):
+    """Return the file yt-dlp wrote for `base_path.%(ext)s`, or None."""
+    outdir = os.path.dirname(base_path) or "."
+    prefix = os.path.basename(base_path) + "."
+    found = None
+    try:
+        with os.scandir(outdir) as it:
+            for e in it:
+                if not e.name.startswith(prefix):
+                    continue
+                # In-progress data: .part, .part-FragN and the .ytdl resume state
+                rest = e.name[len(prefix):]
+                if ".part" in rest or rest.endswith(".ytdl"):
+                    continue
+                if not e.is_file():
+                    continue
+                if not e.name.endswith(".mp3"):
+                    return e.path
+                found = e.path
+    except FileNotFoundError:
+        pass
+    return found
+
+
+def _remove_leftovers(base_path):
+    """Delete every non-MP3 file yt-dlp left behind for `base_path`."""
+    outdir = os.path.dirname(base_path) or "."
+    prefix = os.path.basename(base_path) + "."
+    try:
+        with os.scandir(outdir) as it:
+            for e in it:
+                if e.name.startswith(prefix) and not e.name.endswith(".mp3"):
+                    try:
+                        os.unlink(e.path)
+                    except OSError:
+                        pass
+    except FileNotFoundError:
+        pass
+
+
+def _file_size(path):
+    """Size of path from a single stat, or 0 if it is missing or unreadable."""
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+def _copy_file(src, dst):
+    """Copy src to dst through a temporary name, so dst is never seen half-written.
+
+    A copy rather than a hardlink: the tagger rewrites ID3 in place, and a shared inode
+    would carry one playlist's tags into the cache and into other playlists' files.
+    Returns success.
+    """
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+        return True
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+
+def _store_in_audio_cache(output_mp3, cache_path):
+    """Keep a finished download under cache_path for later runs (best effort)."""
+    if not cache_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    except OSError:
+        return
+    _copy_file(output_mp3, cache_path)
+
+
+def _encode_to_mp3(raw_path, output_mp3, stop_event=None):
+    """Encode a raw download to 192k MP3 on the encode pool, then drop the raw file."""
+    if os.path.abspath(raw_path) == os.path.abspath(output_mp3):
+        return
+    try:
+        _ENCODE_POOL.submit(
+            encode_audio, raw_path, output_mp3, fmt="mp3", bitrate_k=192, stop_event=stop_event
+        ).result()
+    except BaseException:
+        # Never leave a half-written MP3 that a later run would take as finished
+        try:
+            os.unlink(output_mp3)
+        except OSError:
+            pass
+        raise
+    finally:
+        try:
+            os.unlink(raw_path)
+        except OSError:
+            pass
+
+
+def _next_delay(prev, base=1.0, cap=30.0):
+    """Decorrelated jitter: spread parallel workers' retries over [base, 3*prev]."""
+    return min(cap, random.uniform(base, prev * 3))
+
+
+def _interruptible_sleep(stop_event, seconds):
+    """Sleep for seconds, waking early on stop_event. Returns True if cancelled."""
+    if stop_event is None:
+        time.sleep(seconds)
+        return False
+    return stop_event.wait(seconds)
+
+
+_STDERR_TAIL_BYTES = 8192
+
+# Download-only yt-dlp flags: fetch DASH/HLS fragments in parallel, skip setting the file
+# mtime from the server header, and give up on a stalled connection quickly instead of
+# waiting out the overall timeout. Partial data stays in .part until complete, so an
+# interrupted download is never taken for a finished one
+CONCURRENT_FRAGMENTS = 4
+_DOWNLOAD_ARGS = [
+    "--concurrent-fragments", str(CONCURRENT_FRAGMENTS),
+    "--no-mtime",
+    "--socket-timeout", "15",
+]
+
+# Candidates actually downloaded per track. Smart resolver and ISRC matches sort first,
+# so past this point only weaker title matches remain
+MAX_DOWNLOAD_CANDIDATES = 5
+
+# yt-dlp errors that another attempt at the same URL cannot fix
+_FATAL_RE = re.compile(
+    r"Video unavailable|This video is not available|Private video|has been removed"
+    r"|not available in your country|Sign in to confirm your age"
+    r"|unable to obtain file audio codec|Requested format is not available",
+    re.IGNORECASE,
+)
+
+
+def _run_download(download_cmd, verbose=False, stop_event=None, timeout=180):
+    """Run one yt-dlp download and return (returncode, stderr_text).
+
+    stderr goes to a temp file rather than a PIPE so a chatty yt-dlp can't block on a
+    full pipe buffer. Raises KeyboardInterrupt if stop_event fires mid-download and
+    subprocess.TimeoutExpired (after killing yt-dlp) on timeout.
+    """
+    if verbose:
+        proc = subprocess.Popen(download_cmd)
+        ret = wait_process(proc, timeout=timeout, stop_event=stop_event)
+        if ret is None:
+            raise KeyboardInterrupt("Cancelled by user")
+        return ret, ""
+
+    with tempfile.TemporaryFile() as err_file:
+        proc = subprocess.Popen(download_cmd, stdout=subprocess.DEVNULL, stderr=err_file)
+        ret = wait_process(proc, timeout=timeout, stop_event=stop_event)
+        if ret is None:
+            raise KeyboardInterrupt("Cancelled by user")
+        # Only the tail matters for error reporting
+        size = err_file.seek(0, os.SEEK_END)
+        err_file.seek(max(0, size - _STDERR_TAIL_BYTES))
+        return ret, err_file.read().decode("utf-8", errors="replace").strip()
+
+
+def _run_search(search_query, search_count, cmd, cookies_file=None, js_runtime=None):
+    """Run one search and return (entries, error_message).
+
+    Uses the in-process yt_dlp API when available, otherwise the yt-dlp executable.
+    """
+    if YT_DLP_AVAILABLE:
+        try:
+            ydl = _get_ydl(cookies_file, js_runtime)
+            ydl.params["playlistend"] = search_count
+            info = ydl.extract_info(search_query, download=False)
+            return [e for e in (info or {}).get("entries") or [] if e], ""
+        except Exception as e:
+            return [], str(e)
+
+    search_cmd = cmd + [
+        "--dump-json",
+        "--flat-playlist",
+        "--playlist-items", f"1-{search_count}",
+        search_query
+    ]
+    try:
+        proc = subprocess.run(search_cmd, capture_output=True, check=False, timeout=45)
+    except Exception as e:
+        return [], str(e)
+    if proc.returncode != 0:
+        return [], proc.stderr.decode("utf-8", errors="replace")
+
+    # Parse the raw bytes line by line; no full-buffer decode or str copies
+    entries = []
+    for line in proc.stdout.splitlines():
+        if line[:1] != b"{":
+            continue
+        try:
+            entries.append(_json_loads(line))
+        except ValueError:
+            continue
+    return entries, ""
+
+
+# Searches that failed or came back empty, keyed like the search cache, with the
+# time until which they are skipped. In-memory only: a bad query within one run
+# tends to repeat across the playlist, but it may well work on the next run
+NEGATIVE_SEARCH_TTL = 300
+_negative_searches = {}
+
+
+def _cached_search(search_prefix, q_var, search_count, cmd,
+                   cookies_file=None, js_runtime=None, stop_event=None, verbose=False):
+    """Run one prefix/variant search through the persistent search cache."""
+    if stop_event is not None and stop_event.is_set():
+        return [], "Cancelled by user"
+
+    if search_prefix.startswith("http"):
+        search_query = f"{search_prefix}{urllib.parse.quote(q_var)}"
+    else:
+        search_query = f"{search_prefix}{search_count}:{q_var}"
+
+    search_cache = get_search_cache()
+    cache_key = search_cache.make_key(search_prefix, q_var, search_count)
+    entries = search_cache.get(cache_key)
+    if entries is not None:
+        if verbose: print(f"DEBUG: Search cache hit for {search_query}")
+        return entries, ""
+    if _negative_searches.get(cache_key, 0) > time.time():
+        if verbose: print(f"DEBUG: Skipping recently failed search {search_query}")
+        return [], ""
+
+    entries, error = _run_search(search_query, search_count, cmd, cookies_file, js_runtime)
+    if not error and entries:
+        search_cache.set(cache_key, entries)
+    else:
+        _negative_searches[cache_key] = time.time() + NEGATIVE_SEARCH_TTL
+    return entries, error
+
+
+# Fields of a full `-J` info dict that scoring and verification read. Format lists and
+# stream URLs are dropped: they are large and expire within hours
+_FULL_METADATA_FIELDS = (
+    "id", "title", "duration", "uploader", "channel", "channel_is_verified",
+    "album", "isrc", "webpage_url",
+)
+FULL_METADATA_TTL = 7 * 86400
+
+
+def _fetch_full_metadata(video_id, cmd, cookies_file=None, js_runtime=None):
+    """Return the scoring-relevant metadata for video_id, or None.
+
+    Results are kept in the persistent search cache for FULL_METADATA_TTL.
+    """
+    search_cache = get_search_cache()
+    cache_key = search_cache.make_key("full", video_id)
+    cached = search_cache.get(cache_key, ttl=FULL_METADATA_TTL)
+    if cached is not None:
+        return cached
+
+    info = None
+    if YT_DLP_AVAILABLE:
+        try:
+            ydl = _get_ydl(cookies_file, js_runtime)
+            info = ydl.sanitize_info(ydl.extract_info(video_id, download=False))
+        except Exception:
+            return None
+    else:
+        full_cmd = cmd + ["-J", video_id]
+        try:
+            proc_full = subprocess.run(full_cmd, capture_output=True, timeout=20)
+            if proc_full.returncode == 0:
+                info = _json_loads(proc_full.stdout)
+        except Exception:
+            pass
+    if not info:
+        return None
+
+    metadata = {k: info[k] for k in _FULL_METADATA_FIELDS if info.get(k) is not None}
+    search_cache.set(cache_key, metadata)
+    return metadata
+
+
+def _score_candidate(cand_entry, target_s, artist, a_lower, album, album_lower,
+                     q_words, indicator_re, verbose=False):
+    """Score one search candidate; lower is better. Returns (total_score, title_penalty).
+
+    The query-derived arguments are computed once per track by download_audio.
+    """
+    get = cand_entry.get
+    # SMART RESOLVER MATCH - ABSOLUTE HIGHEST PRIORITY (ISRC-First)
+    if get("from_smart_resolver") and get("resolved"):
+        confidence = get("confidence", 0)
+        if verbose: print(f"SMART RESOLVER MATCH - Highest priority for {get('title')} (confidence: {confidence:.2f})")
+        return -9999999, 0  # Absolute highest priority
+    
+    # ISRC MATCH - HIGH PRIORITY
+    if get("isrc_match"):
+        if verbose: print(f"DEBUG: ISRC MATCH - High priority for {get('title')}")
+
+    dur = get("duration")
+    if dur is None:
+        dur_score = 100
+    elif target_s is None:
+        dur_score = 0
+    else:
+        dur_score = abs(dur - target_s)
+
+    title = (get("title") or "").lower()
+    uploader = (get("uploader") or "").lower()
+    channel = (get("channel") or "").lower()
+    is_verified = get("channel_is_verified") or False
+    cand_album = (get("album") or "").lower()
+
+    penalty = 0
+    found_indicators = set(indicator_re.findall(title)) if indicator_re is not None else ()
+    if found_indicators:
+        # One regex scan; each indicator present is penalized once
+        is_official_source = bool(a_lower) and (a_lower in uploader or a_lower in channel)
+        for ind in found_indicators:
+            if (ind in VIDEO_INDICATORS) and (is_official_source or is_verified):
+                penalty += 40 
+            else:
+                penalty += 100 
+
+    title_penalty = 0
+    if q_words:
+        found_words = len(q_words & _get_words(title))
+        match_ratio = found_words / len(q_words)
+        if found_words == 0:
+            title_penalty = 250
+        elif match_ratio < 0.5:
+            title_penalty = (len(q_words) - found_words) * 75
+        else:
+            title_penalty = (len(q_words) - found_words) * 35
+
+    artist_score = 45 
+    if artist:
+        if f"{a_lower} - topic" in uploader or "topic" in uploader or "release - topic" in uploader:
+            artist_score = -150 
+        elif a_lower == uploader or a_lower == channel:
+            artist_score = -30
+        elif a_lower in uploader or a_lower in channel or uploader in a_lower:
+            artist_score = -20
+        elif is_verified:
+            artist_score = -20
+        
+        if artist_score > 0 and len(uploader) > 3 and uploader in title:
+            artist_score += 70
+
+    album_bonus = 0
+    if album and cand_album:
+        if album_lower in cand_album or cand_album in album_lower:
+            album_bonus = -50
+
+    # PRIORITIZE SMART RESOLVER RESULTS (ISRC-First)
+    smart_resolver_bonus = 0
+    if get("from_smart_resolver"):
+        smart_resolver_bonus = -1000  # Highest priority
+    elif get("isrc_match"):
+        smart_resolver_bonus = -500   # High priority for ISRC matches
+
+    perfect_dur_bonus = 0
+    if target_s and dur:
+        diff = abs(dur - target_s)
+        if diff < 2.0:
+            perfect_dur_bonus = -80 
+        elif diff < 5.0:
+            perfect_dur_bonus = -30
+
+    total_score = penalty + artist_score + title_penalty + perfect_dur_bonus + album_bonus + smart_resolver_bonus + (dur_score * 15.0)
+    return total_score, title_penalty
 
 
 def download_audio(
@@ -18,6 +552,8 @@ def download_audio(
     verbose=False,
     search_count=5,
     stop_event=None,
+    cache_dir=None,
+    overwrite=False,
 ):
     """Download audio for query into output_mp3 using yt-dlp executable.
 
@@ -32,15 +568,36 @@ def download_audio(
         verbose: if True, show external tool output instead of capturing it
         search_count: number of ytsearch results to consider
         stop_event: optional threading.Event for cancellation
+        cache_dir: optional directory of finished downloads keyed by (query, duration_ms);
+            a hit is copied into place (untagged) instead of searching and downloading again
+        overwrite: if False, an existing output_mp3 larger than 1 KiB is kept as-is
     """
     outdir = os.path.dirname(output_mp3)
     if outdir:
         os.makedirs(outdir, exist_ok=True)
 
+    # Resume fast path: one stat instead of a search + download + encode
+    if not overwrite and _file_size(output_mp3) > 1024:
+        if verbose: print(f"Already downloaded: {output_mp3}")
+        return True
+
+    cache_path = None
+    if cache_dir:
+        cache_key = SearchCache.make_key(query, duration_ms)
+        cache_path = os.path.join(cache_dir, f"{cache_key}.mp3")
+        if _file_size(cache_path) > 1024 and _copy_file(cache_path, output_mp3):
+            if verbose: print(f"Using cached audio: {cache_path}")
+            return True
+
+    # yt-dlp saves the raw bestaudio stream; ffmpeg encodes it separately
+    base_path = os.path.splitext(output_mp3)[0]
+    raw_template = base_path.replace("%", "%%") + ".%(ext)s"
+
     # Check for cookies file (SAFE METHOD for age-restricted content)
     cookies_file = "config/cookies.txt"
     
-    if os.path.exists(cookies_file):
+    has_cookies = os.path.exists(cookies_file)
+    if has_cookies:
         if verbose:
             print(f"Using cookies from {cookies_file} for age-restricted content")
         cookies_arg = ["--cookies", cookies_file]
@@ -51,77 +608,43 @@ def download_audio(
         cookies_arg = ["--username", "oauth2", "--password", ""]
         oauth2_active = True
     
-    # ... (JS runtime and yt-dlp path detection code remains same)
-    js_runtime = None
-    for name in ("deno", "node"):
-        path = shutil.which(name)
-        if path:
-            js_runtime = (name, path)
-            break
-
-    yt_dlp_path = shutil.which("yt-dlp")
-    if yt_dlp_path is None:
-        import sys
-        # Try Python module method
-        try:
-            import yt_dlp
-            # Check if yt_dlp module is available
-            cmd = [sys.executable, "-m", "yt_dlp"]
-        except ImportError:
-            print("ERROR: yt-dlp not found! Please install: pip install yt-dlp")
-            return False
-    else:
-        cmd = [yt_dlp_path]
-
-    if js_runtime:
-        cmd += ["--js-runtimes", f"{js_runtime[0]}:{js_runtime[1]}"]
-    
-    # Add cookies argument
-    cmd += cookies_arg
-    
-    # Add JavaScript challenge solver with Node.js (DISABLED - causes issues)
-    # cmd += ["--remote-components", "ejs:github"]
-    
-    # Force audio format selection to avoid downloading only images
-    cmd += ["--extract-audio", "--audio-format", "mp3", "--audio-quality", "192k"]
-    
-    # Add fallback option without JavaScript challenge
-    cmd += ["--no-check-certificate"]
-    
-    # Force Node.js runtime
-    if js_runtime:
-        cmd += ["--js-runtimes", f"{js_runtime[0]}:{js_runtime[1]}"]
-    else:
-        # Try to find Node.js
-        node_path = shutil.which("node")
-        if node_path:
-            cmd += ["--js-runtimes", f"node:{node_path}"]
-        else:
-            # Fallback to system Node.js
-            cmd += ["--js-runtimes", "node"]
+    base_cmd, js_runtime = _base_cmd(os.environ.get("PATH", os.defpath), tuple(cookies_arg))
+    if base_cmd is None:
+        print("ERROR: yt-dlp not found! Please install: pip install yt-dlp")
+        return False
+    cmd = list(base_cmd)
 
     prefixes = ["https://music.youtube.com/search?q=", "ytsearch"]
     query_variants = [query]
     
-    clean_q = query.lower().replace("official audio", "").strip() if query else ""
+    # Lowercased inputs are reused by variant building, ISRC matching and scoring
+    q_lower = query.lower() if query else ""
+    a_lower = artist.lower() if artist else ""
+    album_lower = album.lower() if album else ""
+    isrc_lower = isrc.lower() if isrc else ""
+    
+    clean_q = q_lower.replace("official audio", "").strip()
     
     if artist:
-        clean_artist = artist.lower() if artist else ""
-        title_only = clean_q.replace(clean_artist, "").replace("-", " ").strip()
+        title_only = clean_q.replace(a_lower, "").replace("-", " ").strip()
         variants = [
             f"{artist} - {title_only}",
             f"{title_only} - {artist}",
             title_only,
             f"{title_only} {artist}"
         ]
+        # Variants that only reorder the same words return near-identical results;
+        # keep the first of each word set so every search is a distinct query
+        seen = {_variant_key(query)}
         for v in variants:
-            if v and len(v) > 2 and v not in query_variants:
-                query_variants.append(v)
-    
-    # ENABLE SMART RESOLVER FOR ACCURACY
-    from src.smart_resolver import SmartResolver
-    resolver = SmartResolver()
+            if v and len(v) > 2:
+                key = _variant_key(v)
+                if key not in seen:
+                    seen.add(key)
+                    query_variants.append(v)
+        del query_variants[MAX_QUERY_VARIANTS:]
     
+    # ENABLE SMART RESOLVER FOR ACCURACY (shared resolver, cached per track)
     # Create target_track dict from parameters
     target_track = {
         'artist': artist,
@@ -131,7 +654,7 @@ def download_audio(
         'album': album
     }
     
-    ytmusic_result = resolver.resolve_track(target_track, verbose=verbose)
+    ytmusic_result = smart_resolve_track(target_track, verbose=verbose)
     
     last_stderr = ""
     target_s = duration_ms / 1000.0 if duration_ms else None
@@ -159,157 +682,149 @@ def download_audio(
                 confidence = ytmusic_result.get('confidence', 0)
                 print(f"Added SMART RESOLVED track: {ytmusic_result.get('title')} (confidence: {confidence:.2f})")
     
-    # Traditional yt-dlp search as fallback
-    for search_prefix in prefixes:
-        for q_var in query_variants:
-            if search_prefix.startswith("http"):
-                import urllib.parse
-                encoded_q = urllib.parse.quote(q_var)
-                search_query = f"{search_prefix}{encoded_q}"
-            else:
-                search_query = f"{search_prefix}:{q_var}"
-
-            search_cmd = cmd + [
-                "--dump-json", 
-                "--flat-playlist", 
-                "--playlist-items", f"1-{search_count}",
-                search_query
-            ] + cookies_arg
-            
-            try:
-                proc = subprocess.run(search_cmd, capture_output=True, check=False, timeout=45)
-                if proc.returncode != 0:
-                    last_stderr = proc.stderr.decode("utf-8", errors="replace")
-                    continue
+    ydl_cookies = cookies_file if has_cookies else None
 
-                import json
-                for line in proc.stdout.decode("utf-8", errors="replace").splitlines():
-                    if not line.strip().startswith("{"): continue
-                    try:
-                        data = json.loads(line)
-                        if "id" in data:
-                            # Don't overwrite smart resolver results
-                            if data["id"] not in unique_candidates or not unique_candidates[data["id"]].get("from_smart_resolver"):
-                                # Check for ISRC match early if available
-                                cand_isrc = data.get("isrc")
-                                if isrc and cand_isrc and (isrc.lower() if isrc else "") == (cand_isrc.lower() if cand_isrc else ""):
-                                    data["isrc_match"] = True
-                                    if verbose: print(f"DEBUG: ISRC MATCH found in search results for {data['id']}")
-                                unique_candidates[data["id"]] = data
-                    except:
-                        continue
-            except Exception as e:
-                last_stderr = str(e)
-                continue
+    # FORCE EARLY RETURN for high confidence smart resolver results: download it before
+    # any fallback search, and only search if that download fails
+    hc_video_id = None
+    smart_entry = next(iter(unique_candidates.values()), None)
+    if smart_entry is not None and smart_entry.get("confidence", 0) >= 0.9:  # High confidence threshold
+        if stop_event is not None and stop_event.is_set():
+            raise KeyboardInterrupt("Cancelled by user")
+        video_id = hc_video_id = smart_entry["id"]
+        confidence = smart_entry.get("confidence", 0)
+        if verbose: 
+            print(f"USING HIGH CONFIDENCE SMART RESOLVER: {smart_entry.get('title')} (confidence: {confidence:.2f})")
+            print(f"   Video ID: {video_id}")
+            print(f"   Duration: {smart_entry.get('duration', 0)}s")
+        
+        # If crucial info is missing or it looks like a false title match, fetch full metadata
+        title = smart_entry.get("title") or ""
+        dur = smart_entry.get("duration")
+        uploader = smart_entry.get("uploader")
+        
+        needs_fetch = not title or dur is None or uploader is None
+        
+        if needs_fetch:
+            if verbose: print(f"DEBUG: Fetching full metadata for {video_id}...")
+            full_data = _fetch_full_metadata(video_id, cmd, ydl_cookies, js_runtime)
+            if full_data:
+                # Update entry with full metadata
+                smart_entry.update(full_data)
+                title = smart_entry.get("title") or ""
+                dur = smart_entry.get("duration")
+                uploader = smart_entry.get("uploader")
+            elif verbose:
+                print(f"DEBUG: Full metadata fetch failed for {video_id}")
+        
+        # Proceed with download using this high confidence result
+        try:
+            # Build download command
+            download_cmd = cmd + _DOWNLOAD_ARGS + [
+                "-f", "bestaudio/best",
+                "-o", raw_template,
+                f"https://music.youtube.com/watch?v={video_id}"
+            ]
+            
+            if verbose:
+                print(f"Downloading: {title} ({video_id})")
+            
+            ret, err_text = _run_download(download_cmd, stop_event=stop_event)
+            raw_path = _find_raw_download(base_path) if ret == 0 else None
+            
+            if raw_path:
+                _encode_to_mp3(raw_path, output_mp3, stop_event)
+                _store_in_audio_cache(output_mp3, cache_path)
+                if verbose: print(f"Download successful: {output_mp3}")
+                return True
+            else:
+                if err_text:
+                    last_stderr = err_text
+                _remove_leftovers(base_path)
+                if verbose: print(f"Download failed: {err_text}")
+                
+        except KeyboardInterrupt:
+            _remove_leftovers(base_path)
+            raise
+        except Exception as e:
+            # Includes TimeoutExpired and encode failures: the fallback candidates reuse
+            # raw_template
+            last_stderr = str(e)
+            _remove_leftovers(base_path)
+            if verbose: print(f"Download error: {e}")
+
+    # Traditional yt-dlp search as fallback: submit every prefix x variant at once,
+    # then merge in submission order so results stay deterministic
+    search_futures = [
+        _SEARCH_POOL.submit(
+            _cached_search, search_prefix, q_var, search_count, cmd,
+            ydl_cookies, js_runtime, stop_event, verbose,
+        )
+        for search_prefix in prefixes
+        for q_var in query_variants
+    ]
+
+    for fut in search_futures:
+        entries, error = fut.result()
+        if error:
+            last_stderr = error
+            continue
+
+        for data in entries:
+            if "id" in data:
+                # Don't overwrite smart resolver results
+                if data["id"] not in unique_candidates or not unique_candidates[data["id"]].get("from_smart_resolver"):
+                    # Check for ISRC match early if available
+                    cand_isrc = data.get("isrc")
+                    if isrc_lower and cand_isrc and isrc_lower == cand_isrc.lower():
+                        data["isrc_match"] = True
+                        if verbose: print(f"DEBUG: ISRC MATCH found in search results for {data['id']}")
+                    unique_candidates[data["id"]] = data
+
+    if stop_event is not None and stop_event.is_set():
+        raise KeyboardInterrupt("Cancelled by user")
 
     if not unique_candidates:
         return False
 
-    def get_score(cand_entry):
-        # SMART RESOLVER MATCH - ABSOLUTE HIGHEST PRIORITY (ISRC-First)
-        if cand_entry.get("from_smart_resolver") and cand_entry.get("resolved"):
-            confidence = cand_entry.get("confidence", 0)
-            if verbose: print(f"SMART RESOLVER MATCH - Highest priority for {cand_entry.get('title')} (confidence: {confidence:.2f})")
-            return -9999999, 0  # Absolute highest priority
-        
-        # ISRC MATCH - HIGH PRIORITY
-        if cand_entry.get("isrc_match"):
-            if verbose: print(f"DEBUG: ISRC MATCH - High priority for {cand_entry.get('title')}")
-
-        dur = cand_entry.get("duration")
-        if dur is None:
-            dur_score = 100
-        elif target_s is None:
-            dur_score = 0
-        else:
-            dur_score = abs(dur - target_s)
-
-        title = (cand_entry.get("title") or "").lower()
-        uploader = (cand_entry.get("uploader") or "").lower()
-        channel = (cand_entry.get("channel") or "").lower()
-        is_verified = cand_entry.get("channel_is_verified") or False
-        cand_album = (cand_entry.get("album") or "").lower()
-
-        indicators = ["remix", "live", "acoustic", "instrumental", "cover", "karaoke", "sped up", "slowed", "concert", "perform", "tour", "video", "official video", "mv"]
-        penalty = 0
-        for ind in indicators:
-            if ind in title and ind not in (query.lower() if query else ""):
-                is_official_source = artist and (artist.lower() if artist else "" in uploader or (artist.lower() if artist else "" in channel))
-                if (ind in ["video", "official video", "mv"]) and (is_official_source or is_verified):
-                    penalty += 40 
-                else:
-                    penalty += 100 
-
-        title_penalty = 0
-        if artist:
-            import re
-            def get_words(s):
-                s = s.lower().replace("official audio", "").replace("official music video", "")
-                return set(re.findall(r'\w+', s))
-
-            # clean_artist is defined in the outer scope, but for clarity and self-containment
-            # within the function, we can re-derive it or pass it. Let's re-derive.
-            local_clean_artist = artist.lower() if artist else ""
-            q_title_part = (query.lower() if query else "").replace(local_clean_artist, "").strip()
-            q_words = get_words(q_title_part)
-            t_words = get_words(title)
-
-            if q_words:
-                found_words = sum(1 for w in q_words if w in t_words)
-                match_ratio = found_words / len(q_words)
-                if found_words == 0:
-                    title_penalty = 250
-                elif match_ratio < 0.5:
-                    title_penalty = (len(q_words) - found_words) * 75
-                else:
-                    title_penalty = (len(q_words) - found_words) * 35
-
-        artist_score = 45 
-        if artist:
-            a_lower = artist.lower() if artist else ""
-            if f"{a_lower} - topic" in uploader or "topic" in uploader or "release - topic" in uploader:
-                artist_score = -150 
-            elif a_lower == uploader or a_lower == channel:
-                artist_score = -30
-            elif a_lower in uploader or a_lower in channel or uploader in a_lower:
-                artist_score = -20
-            elif is_verified:
-                artist_score = -20
-            
-            if artist_score > 0 and len(uploader) > 3 and uploader in title:
-                artist_score += 70
-
-        album_bonus = 0
-        if album and cand_album:
-            if (album.lower() if album else "" in cand_album or cand_album in (album.lower() if album else "")):
-                album_bonus = -50
-
-        # PRIORITIZE SMART RESOLVER RESULTS (ISRC-First)
-        smart_resolver_bonus = 0
-        if entry.get("from_smart_resolver"):
-            smart_resolver_bonus = -1000  # Highest priority
-        elif entry.get("isrc_match"):
-            smart_resolver_bonus = -500   # High priority for ISRC matches
-
-        perfect_dur_bonus = 0
-        if target_s and dur:
-            diff = abs(dur - target_s)
-            if diff < 2.0:
-                perfect_dur_bonus = -80 
-            elif diff < 5.0:
-                perfect_dur_bonus = -30
-
-        total_score = penalty + artist_score + title_penalty + perfect_dur_bonus + album_bonus + smart_resolver_bonus + (dur_score * 15.0)
-        return total_score, title_penalty
+    # Query-derived values are the same for every candidate; compute them once
+    q_words = _get_words(q_lower.replace(a_lower, "").strip()) if artist else set()
+    active_indicators = [ind for ind in INDICATORS if ind not in q_lower]
+    indicator_re = (
+        # Zero-width lookahead: matches may overlap ("video" inside "official video"),
+        # so every indicator in the title is found, exactly like `ind in title`
+        re.compile(r"(?=(" + "|".join(re.escape(ind) for ind in active_indicators) + "))")
+        if active_indicators else None
+    )
+
+    get_score = partial(
+        _score_candidate,
+        target_s=target_s,
+        artist=artist,
+        a_lower=a_lower,
+        album=album,
+        album_lower=album_lower,
+        q_words=q_words,
+        indicator_re=indicator_re,
+        verbose=verbose,
+    )
 
     scored = []
     for entry in unique_candidates.values():
+        # A known duration more than 15s off is rejected by the candidate loop anyway;
+        # drop it before scoring and before any full-metadata fetch for it
+        if target_s and not entry.get("from_smart_resolver"):
+            cand_dur = entry.get("duration")
+            if cand_dur and abs(cand_dur - target_s) > 15.0:
+                if verbose: print(f"Skipping {entry.get('title')} - Duration diff {abs(cand_dur - target_s):.1f}s > 15.0s limit")
+                continue
         score, _ = get_score(entry)
         scored.append((score, entry))
 
     scored.sort(key=lambda x: x[0])
     
     # Try top candidates until success
+    tried = 0
     for initial_score, entry in scored:
         if stop_event is not None and stop_event.is_set():
             raise KeyboardInterrupt("Cancelled by user")
@@ -317,65 +832,9 @@ def download_audio(
         video_id = entry.get("id")
         if not video_id: continue
         
-        # FORCE EARLY RETURN for high confidence smart resolver results
-        if entry.get("from_smart_resolver") and entry.get("resolved"):
-            confidence = entry.get("confidence", 0)
-            if confidence >= 0.9:  # High confidence threshold
-                if verbose: 
-                    print(f"USING HIGH CONFIDENCE SMART RESOLVER: {entry.get('title')} (confidence: {confidence:.2f})")
-                    print(f"   Video ID: {video_id}")
-                    print(f"   Duration: {entry.get('duration', 0)}s")
-                
-                # Skip all other candidates and use this one directly
-                video_id = entry.get("id")
-                
-                # If crucial info is missing or it looks like a false title match, fetch full metadata
-                title = entry.get("title") or ""
-                dur = entry.get("duration")
-                uploader = entry.get("uploader")
-                
-                needs_fetch = not title or dur is None or uploader is None
-                
-                if needs_fetch:
-                    try:
-                        if verbose: print(f"DEBUG: Fetching full metadata for {video_id}...")
-                        full_cmd = cmd + ["-J", video_id] + cookies_arg
-                        proc_full = subprocess.run(full_cmd, capture_output=True, text=True, timeout=20)
-                        if proc_full.returncode == 0:
-                            full_data = json.loads(proc_full.stdout)
-                            # Update entry with full metadata
-                            entry.update(full_data)
-                            title = entry.get("title") or ""
-                            dur = entry.get("duration")
-                            uploader = entry.get("uploader")
-                    except Exception as e:
-                        if verbose: print(f"DEBUG: Full metadata fetch failed: {e}")
-                
-                # Proceed with download using this high confidence result
-                try:
-                    # Build download command
-                    download_cmd = cmd + [
-                        "-f", "bestaudio/best",
-                        "-x", "--audio-format", "mp3", "--audio-quality", "192k",
-                        "-o", output_mp3,
-                        f"https://music.youtube.com/watch?v={video_id}"
-                    ]
-                    
-                    if verbose:
-                        print(f"Downloading: {title} ({video_id})")
-                    
-                    proc = subprocess.run(download_cmd, capture_output=True, check=False, timeout=180)
-                    
-                    if proc.returncode == 0:
-                        if verbose: print(f"Download successful: {output_mp3}")
-                        return True
-                    else:
-                        if verbose: print(f"Download failed: {proc.stderr.decode('utf-8', errors='replace')}")
-                        continue  # Try next candidate
-                        
-                except Exception as e:
-                    if verbose: print(f"Download error: {e}")
-                    continue  # Try next candidate
+        # The high-confidence smart resolver result was already tried before searching
+        if video_id == hc_video_id:
+            continue
         
         # Original logic for other candidates (non-high-confidence smart resolver)
         # If crucial info is missing or it looks like a false title match, fetch full metadata
@@ -385,24 +844,21 @@ def download_audio(
         
         needs_fetch = not title or dur is None or uploader is None
         
+        # The ranking score stays valid unless a full fetch changes the metadata
+        total_score = initial_score
         if needs_fetch:
-            try:
-                if verbose: print(f"DEBUG: Fetching full metadata for {video_id}...")
-                full_cmd = cmd + ["-J", video_id] + cookies_arg
-                proc_full = subprocess.run(full_cmd, capture_output=True, text=True, timeout=20)
-                if proc_full.returncode == 0:
-                    full_data = json.loads(proc_full.stdout)
-                    entry.update(full_data) # Update with ALL new metadata
-                    # Re-check ISRC after full fetch
-                    cand_isrc = full_data.get("isrc")
-                    if isrc and cand_isrc and (isrc.lower() if isrc else "") == (cand_isrc.lower() if cand_isrc else ""):
-                        entry["isrc_match"] = True
-                        if verbose: print(f"DEBUG: ISRC MATCH confirmed after full fetch for {video_id}!")
-            except:
-                pass
-
-        # RE-CALCULATE EVERYTHING based on final metadata
-        total_score, title_penalty = get_score(entry)
+            if verbose: print(f"DEBUG: Fetching full metadata for {video_id}...")
+            full_data = _fetch_full_metadata(video_id, cmd, ydl_cookies, js_runtime)
+            if full_data:
+                entry.update(full_data) # Update with ALL new metadata
+                # Re-check ISRC after full fetch
+                cand_isrc = full_data.get("isrc")
+                if isrc_lower and cand_isrc and isrc_lower == cand_isrc.lower():
+                    entry["isrc_match"] = True
+                    if verbose: print(f"DEBUG: ISRC MATCH confirmed after full fetch for {video_id}!")
+
+                # RE-CALCULATE EVERYTHING based on final metadata
+                total_score, _ = get_score(entry)
         dur = entry.get("duration")
         uploader = (entry.get("uploader") or "").lower()
 
@@ -431,33 +887,62 @@ def download_audio(
         video_url = entry.get("url") or entry.get("webpage_url") or video_id
         if not video_url: continue
 
+        if tried >= MAX_DOWNLOAD_CANDIDATES:
+            break
+        tried += 1
+
         if verbose:
             print(f"Chosen candidate (Score: {total_score:.1f}): {entry.get('title')} | Uploader: {uploader}")
 
-        download_cmd = cmd + [
+        download_cmd = cmd + _DOWNLOAD_ARGS + [
             "--no-playlist",
             "-f", "bestaudio/best",
-            "-x", "--audio-format", "mp3", "--audio-quality", "192k",
-        ] + cookies_arg + [
-            "-o", output_mp3,
+            "-o", raw_template,
             video_url
         ]
         
         max_attempts = 2
+        retry_delay = 1.0
         for attempt in range(1, max_attempts + 1):
+            # Back off before retrying the same URL; a cancel cuts the wait short
+            if attempt > 1:
+                retry_delay = _next_delay(retry_delay)
+                if _interruptible_sleep(stop_event, retry_delay):
+                    raise KeyboardInterrupt("Cancelled by user")
             try:
-                p_dl = subprocess.Popen(download_cmd, stdout=subprocess.PIPE if not verbose else None, stderr=subprocess.PIPE if not verbose else None)
-                ret = p_dl.wait(timeout=180)
+                ret, err_text = _run_download(download_cmd, verbose=verbose, stop_event=stop_event)
+                if ret != 0 and err_text:
+                    last_stderr = err_text
+                    if _FATAL_RE.search(err_text):
+                        # Terminal for this video; skip the retry and move to the next candidate
+                        _remove_leftovers(base_path)
+                        break
+                
+                # Hand the raw stream to the encode pool; the track worker only waits on it
+                raw_path = _find_raw_download(base_path) if ret == 0 else None
+                if raw_path:
+                    try:
+                        _encode_to_mp3(raw_path, output_mp3, stop_event)
+                    except RuntimeError as e:
+                        # The raw file is gone and a re-download would encode the same
+                        # stream again; move on to the next candidate
+                        last_stderr = str(e)
+                        _remove_leftovers(base_path)
+                        break
                 
-                # Cleanup intermediate junk
-                base_p = os.path.splitext(output_mp3)[0]
-                for ext in [".m4a", ".webm", ".f140", ".f251", ".part"]:
-                    if os.path.exists(base_p + ext):
-                        try: os.remove(base_p + ext)
-                        except: pass
-
-                if ret == 0 and os.path.exists(output_mp3) and os.path.getsize(output_mp3) > 1024:
+                # Cleanup intermediate junk (.part, .ytdl, format-coded fragments) in one pass
+                _remove_leftovers(base_path)
+
+                if ret == 0 and _file_size(output_mp3) > 1024:
+                    _store_in_audio_cache(output_mp3, cache_path)
                     return # Success
+            except subprocess.TimeoutExpired:
+                last_stderr = f"yt-dlp timed out after 180s for {video_url}"
+                _remove_leftovers(base_path)
+                continue
+            except KeyboardInterrupt:
+                _remove_leftovers(base_path)
+                raise
             except:
                 continue
 
@@ -1,6 +1,126 @@
 import subprocess
 import os
-import time
+import select
+import threading
+import weakref
+from functools import lru_cache
+
+
+def _kill(proc):
+    try:
+        proc.kill()
+    except Exception:
+        pass
+    try:
+        proc.wait(timeout=5)
+    except Exception:
+        pass
+
+
+# Bytes of ffmpeg stderr kept for error messages
+_STDERR_TAIL_BYTES = 8192
+
+
+def _drain(pipe, tail):
+    """Consume pipe until EOF, keeping only its last _STDERR_TAIL_BYTES in tail."""
+    try:
+        for chunk in iter(lambda: pipe.read1(65536), b""):
+            tail += chunk
+            if len(tail) > _STDERR_TAIL_BYTES:
+                del tail[:-_STDERR_TAIL_BYTES]
+    except (OSError, ValueError):
+        pass
+
+
+# Children currently inside wait_process, so a cancel can kill them directly instead
+# of every waiter waking up periodically to check its stop_event
+_running = weakref.WeakSet()
+_running_lock = threading.Lock()
+
+
+def kill_running():
+    """Kill every process currently waited on by wait_process (call after setting stop_event)."""
+    with _running_lock:
+        procs = list(_running)
+    for proc in procs:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+
+
+def wait_process(proc, timeout=None, stop_event=None):
+    """Wait for proc to exit, killing it on timeout or when stop_event is set.
+
+    Returns the exit code, or None if it was cancelled through stop_event.
+    Raises subprocess.TimeoutExpired after killing it on timeout.
+
+    On Linux the exit is picked up from a pidfd via poll(), so the thread sleeps in
+    the kernel instead of Popen.wait's sleep/retry loop; elsewhere it falls back to
+    Popen.wait. The wait blocks until exit or timeout; cancellation arrives through
+    kill_running(), which the caller must invoke after setting stop_event.
+    """
+    if proc.returncode is not None:
+        return proc.returncode
+
+    with _running_lock:
+        _running.add(proc)
+    try:
+        # A cancel that ran before proc was registered would have missed it
+        if stop_event is not None and stop_event.is_set():
+            _kill(proc)
+            return None
+        ret = _wait(proc, timeout)
+    finally:
+        with _running_lock:
+            _running.discard(proc)
+
+    if stop_event is not None and stop_event.is_set():
+        return None
+    return ret
+
+
+def _wait(proc, timeout):
+    """Block until proc exits; kill it and raise TimeoutExpired after timeout."""
+    if hasattr(os, "pidfd_open") and hasattr(select, "poll"):
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except OSError:
+            # Already reaped, or kernel < 5.3
+            pidfd = None
+        if pidfd is not None:
+            try:
+                poller = select.poll()
+                poller.register(pidfd, select.POLLIN)
+                if not poller.poll(None if timeout is None else max(1, int(timeout * 1000))):
+                    _kill(proc)
+                    raise subprocess.TimeoutExpired(proc.args, timeout)
+                return proc.wait()
+            finally:
+                os.close(pidfd)
+
+    try:
+        return proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(proc)
+        raise
+
+
+@lru_cache(maxsize=1)
+def _ffmpeg_encoders():
+    """Names of the audio encoders this ffmpeg build provides (probed once)."""
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return frozenset()
+    # Lines look like " A....D libmp3lame  libmp3lame MP3 ..."
+    return frozenset(
+        parts[1] for parts in (line.split() for line in out.decode("utf-8", "replace").splitlines())
+        if len(parts) > 1 and parts[0].startswith("A")
+    )
 
 
 def encode_audio(
@@ -12,10 +132,13 @@ def encode_audio(
 
     codec_args = []
     if fmt == "aac":
-        # Use native AAC encoder, container .m4a
-        codec_args = ["-c:a", "aac", "-b:a", f"{bitrate_k}k"]
+        # Container .m4a; Fraunhofer FDK AAC when the build has it, else native AAC
+        encoder = "libfdk_aac" if "libfdk_aac" in _ffmpeg_encoders() else "aac"
+        codec_args = ["-c:a", encoder, "-b:a", f"{bitrate_k}k"]
     elif fmt == "ogg":
-        codec_args = ["-c:a", "libvorbis", "-b:a", f"{bitrate_k}k"]
+        # Opus in Ogg encodes faster and smaller than Vorbis at the same bitrate
+        encoder = "libopus" if "libopus" in _ffmpeg_encoders() else "libvorbis"
+        codec_args = ["-c:a", encoder, "-b:a", f"{bitrate_k}k"]
     else:
         codec_args = ["-c:a", "libmp3lame", "-b:a", f"{bitrate_k}k"]
 
@@ -23,8 +146,19 @@ def encode_audio(
         [
             "ffmpeg",
             "-y",
+            # Errors only, so the tail that _drain keeps is short and relevant
+            "-hide_banner",
+            "-nostats",
+            "-loglevel",
+            "error",
+            # One thread each for decode and encode: parallelism comes from running
+            # several encodes at once, which the caller bounds (downloader._ENCODE_POOL)
+            "-threads",
+            "1",
             "-i",
             input_wav,
+            "-threads",
+            "1",
             "-map_metadata",
             "-1",
             "-vn",
@@ -33,47 +167,24 @@ def encode_audio(
         + [output_file]
     )
 
-    stdout_pipe = subprocess.PIPE
-    stderr_pipe = subprocess.PIPE
-    proc = subprocess.Popen(cmd, stdout=stdout_pipe, stderr=stderr_pipe)
+    # ffmpeg writes its output to a file, so stdout is discarded. stderr is drained as
+    # it is produced, so the child never blocks on a full pipe
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr_tail = bytearray()
+    drainer = threading.Thread(target=_drain, args=(proc.stderr, stderr_tail), daemon=True)
+    drainer.start()
 
     try:
-        start_time = time.time()
-        while True:
-            try:
-                # Gunakan timeout yang lebih besar (misalnya 5 detik) untuk menghindari
-                # pemanggilan wait() yang terlalu sering
-                ret = proc.wait(timeout=5)
-                break
-            except subprocess.TimeoutExpired:
-                # check cancellation
-                if stop_event is not None and stop_event.is_set():
-                    try:
-                        proc.kill()
-                    except Exception:
-                        pass
-                    proc.wait()
-                    raise RuntimeError("Encoding cancelled by user")
-
-                # enforce timeout if set
-                if timeout_sec is not None and (time.time() - start_time) > timeout_sec:
-                    try:
-                        proc.kill()
-                    except Exception:
-                        pass
-                    try:
-                        proc.wait(timeout=5)
-                    except Exception:
-                        pass
-                    raise RuntimeError(f"Encoding timed out after {timeout_sec}s")
-                continue
+        try:
+            ret = wait_process(proc, timeout=timeout_sec, stop_event=stop_event)
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"Encoding timed out after {timeout_sec}s")
+        if ret is None:
+            raise RuntimeError("Encoding cancelled by user")
 
         if ret != 0:
-            stderr = ""
-            try:
-                stderr = proc.stderr.read().decode("utf-8", errors="replace")
-            except Exception:
-                pass
+            drainer.join(timeout=5)
+            stderr = stderr_tail.decode("utf-8", errors="replace").strip()
             raise RuntimeError(f"ffmpeg failed for {output_file}: {stderr}")
     finally:
         try:
@@ -81,6 +192,8 @@ def encode_audio(
                 proc.kill()
         except Exception:
             pass
+        drainer.join(timeout=5)
+        proc.stderr.close()
 
 
 # Backwards compatible wrapper
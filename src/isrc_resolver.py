@@ -356,9 +356,8 @@ def resolve_track_by_isrc(isrc: str, verbose: bool = False) -> Optional[Dict]:
     """
     try:
         # Load Spotify credentials
-        import json
-        with open('config/spotify.json', 'r') as f:
-            spotify_config = json.load(f)
+        from .config import load_spotify_config
+        spotify_config = load_spotify_config()
         
         resolver = create_isrc_resolver(
             spotify_config['client_id'], 
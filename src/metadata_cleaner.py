@@ -1,3 +1,13 @@
+from collections import namedtuple
+
+
+# Record ringan per track; akses atribut lebih murah daripada lookup dict di worker
+Track = namedtuple(
+    "Track",
+    "title artist album album_artist year duration_ms track_number genre isrc cover_url",
+)
+
+
 def clean_metadata(tracks_or_tuple):
     # Handle both tracks list and tuple (tracks, playlist_name)
     if isinstance(tracks_or_tuple, tuple) or isinstance(tracks_or_tuple, list):
@@ -11,17 +21,17 @@ def clean_metadata(tracks_or_tuple):
     clean = []
     for t in tracks:
         clean.append(
-            {
-                "title": t["title"],
-                "artist": t["artist"],
-                "album": t["album"],
-                "album_artist": t["album_artist"],
-                "year": t["year"],
-                "duration_ms": t.get("duration_ms", 0),
-                "track_number": t["track_number"],
-                "genre": t["genre"],
-                "isrc": t.get("isrc", ""),  # Tambahkan ISRC!
-                "cover_url": t["cover_url"],
-            }
+            Track(
+                title=t["title"],
+                artist=t["artist"],
+                album=t["album"],
+                album_artist=t["album_artist"],
+                year=t["year"],
+                duration_ms=t.get("duration_ms", 0),
+                track_number=t["track_number"],
+                genre=t["genre"],
+                isrc=t.get("isrc", ""),  # Tambahkan ISRC!
+                cover_url=t["cover_url"],
+            )
         )
     return clean
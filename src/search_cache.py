@@ -0,0 +1,94 @@
+"""
+Search Cache
+Cache persisten (SQLite, WAL mode) untuk hasil pencarian yt-dlp antar run
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Optional
+
+DEFAULT_CACHE_PATH = os.path.join("cache", "search_cache.db")
+DEFAULT_TTL = 7 * 86400  # 7 hari
+
+
+class SearchCache:
+    """Key -> JSON value (candidate lists, video metadata), with a TTL"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: int = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        try:
+            cache_dir = os.path.dirname(path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache "
+                "(key TEXT PRIMARY KEY, ts INTEGER, json TEXT)"
+            )
+            self._conn.commit()
+        except Exception as e:
+            # Cache is an optimization only; never block downloads on it
+            print(f"WARNING: Search cache disabled: {e}")
+            self._conn = None
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Build a compact cache key from the given parts"""
+        raw = "|".join(str(p) for p in parts)
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str, ttl: Optional[int] = None) -> Optional[Any]:
+        """Return cached value for key, or None if missing or older than ttl (default: self.ttl)"""
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT ts, json FROM search_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+
+        if not row or time.time() - row[0] >= (self.ttl if ttl is None else ttl):
+            return None
+        try:
+            return json.loads(row[1])
+        except ValueError:
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """Store value under key with the current timestamp"""
+        if self._conn is None:
+            return
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, ts, json) VALUES (?, ?, ?)",
+                    (key, int(time.time()), payload),
+                )
+                self._conn.commit()
+        except (sqlite3.Error, TypeError, ValueError):
+            pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    """Return the shared SearchCache instance"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SearchCache()
+    return _cache
@@ -6,5 +6,5 @@ def build_query(track, use_official=True):
 
     # Including album name significantly improves finding the correct official version
 
-    return f'{track["title"]} {track["artist"]} {track["album"]}'
+    return f"{track.title} {track.artist} {track.album}"
 
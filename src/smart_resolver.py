@@ -5,10 +5,13 @@ ISRC-First dengan Smart Fallback untuk operational use
 
 import sys
 import os
+import threading
 from typing import Dict, Optional
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
+from .config import load_spotify_config
+from .search_cache import get_search_cache
 from .isrc_resolver import AntigravityISRCResolver
 from .ytmusic_resolver import resolve_with_ytmusic
 
@@ -17,9 +20,7 @@ class SmartResolver:
     
     def __init__(self):
         try:
-            import json
-            with open('config/spotify.json', 'r') as f:
-                spotify_config = json.load(f)
+            spotify_config = load_spotify_config()
             
             self.isrc_resolver = AntigravityISRCResolver(
                 spotify_config['client_id'],
@@ -91,8 +92,65 @@ def smart_resolve_track(track: Dict, verbose: bool = False) -> Optional[Dict]:
     Returns:
         Resolved track dict atau None
     """
-    resolver = SmartResolver()
-    return resolver.resolve_track(track, verbose)
+    result = _resolve_cached(
+        track.get('isrc') or '',
+        track.get('artist') or '',
+        track.get('title') or '',
+        track.get('album') or '',
+        track.get('duration_ms') or 0,
+        verbose,
+    )
+    # Copy supaya caller tidak bisa mengubah hasil yang di-cache
+    return dict(result) if result else None
+
+# Satu SmartResolver per thread: spotipy dan YTMusic sessions tidak thread-safe
+_local = threading.local()
+
+def _init_failed(resolver: SmartResolver) -> bool:
+    """True if the Spotify or YTMusic client of resolver could not be created"""
+    if not resolver.has_spotify:
+        return True
+    return resolver.isrc_resolver.ytmusic_resolver.ytmusic is None
+
+def get_smart_resolver() -> SmartResolver:
+    """Return this thread's SmartResolver, rebuilding it if its init failed"""
+    resolver = getattr(_local, "resolver", None)
+    if resolver is None or _init_failed(resolver):
+        resolver = _local.resolver = SmartResolver()
+    return resolver
+
+# Hasil resolve yang berhasil dalam run ini; miss tidak disimpan supaya dicoba lagi
+_memo: Dict[str, Dict] = {}
+_MEMO_MAX = 4096
+
+def _resolve_cached(isrc: str, artist: str, title: str, album: str,
+                    duration_ms: int, verbose: bool) -> Optional[Dict]:
+    """Resolve once per unique track: in memory within a run, in the search cache across runs"""
+    search_cache = get_search_cache()
+    cache_key = search_cache.make_key("smart", isrc, artist.lower(), title.lower(), album.lower(), duration_ms)
+    result = _memo.get(cache_key)
+    if result is not None:
+        return result
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        if len(_memo) < _MEMO_MAX:
+            _memo[cache_key] = cached
+        return cached
+
+    track = {
+        'artist': artist,
+        'title': title,
+        'duration_ms': duration_ms,
+        'isrc': isrc,
+        'album': album
+    }
+    result = get_smart_resolver().resolve_track(track, verbose)
+    # Misses are not persisted; they may be transient (network, rate limits)
+    if result:
+        search_cache.set(cache_key, result)
+        if len(_memo) < _MEMO_MAX:
+            _memo[cache_key] = result
+    return result
 
 # Test function
 def test_smart_resolver():
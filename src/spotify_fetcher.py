@@ -2,9 +2,11 @@ import json, spotipy
 import time
 from spotipy.oauth2 import SpotifyClientCredentials
 
+from .config import SPOTIFY_CONFIG_PATH, load_config
 
-def fetch_playlist(playlist_url, config_path="config/spotify.json"):
-    cfg = json.load(open(config_path))
+
+def fetch_playlist(playlist_url, config_path=SPOTIFY_CONFIG_PATH):
+    cfg = load_config(config_path)
     sp = spotipy.Spotify(
         auth_manager=SpotifyClientCredentials(
             client_id=cfg["client_id"], client_secret=cfg["client_secret"]
@@ -2,20 +2,73 @@ from PIL import Image
 import requests
 from io import BytesIO
 import re
+import threading
+from functools import lru_cache
+from concurrent.futures import Future
 
+# Control chars and reserved characters <>:"/\|?*
+_INVALID_CHARS_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
 
+# One keep-alive session per thread: cover fetches reuse the TLS connection to the CDN
+_session_local = threading.local()
+
+# cover_url -> Future of the resized JPEG bytes; tracks from one album share a single fetch
+_cover_futures = {}
+_cover_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _collapse_re(replacement):
+    return re.compile(f"{re.escape(replacement)}+")
+
+
+# Pure function of its input; the same artist/title pairs are sanitized repeatedly
+@lru_cache(maxsize=4096)
 def sanitize_filename(name, replacement="_"):
     """Return a filesystem-safe filename by replacing or removing invalid characters."""
     # Remove control chars and replace reserved characters <>:"/\|?*
-    sanitized = re.sub(r'[<>:"/\\|?*\x00-\x1f]', replacement, name)
+    sanitized = _INVALID_CHARS_RE.sub(replacement, name)
     # Collapse multiple replacements
-    sanitized = re.sub(rf"{re.escape(replacement)}+", replacement, sanitized)
+    sanitized = _collapse_re(replacement).sub(replacement, sanitized)
     return sanitized.strip()
 
 
-def process_cover(url, output_path):
-    r = requests.get(url, timeout=10)
+def _get_session():
+    session = getattr(_session_local, "session", None)
+    if session is None:
+        session = _session_local.session = requests.Session()
+    return session
+
+
+def _download_cover(url):
+    r = _get_session().get(url, timeout=10)
     r.raise_for_status()
     img = Image.open(BytesIO(r.content)).convert("RGB")
     img.thumbnail((500, 500))
-    img.save(output_path, "JPEG", quality=85, optimize=True)
+    out = BytesIO()
+    img.save(out, "JPEG", quality=85, optimize=True)
+    return out.getvalue()
+
+
+def fetch_cover(url):
+    """Return the resized cover JPEG for url, fetching each distinct url only once."""
+    with _cover_lock:
+        fut = _cover_futures.get(url)
+        owner = fut is None
+        if owner:
+            fut = _cover_futures[url] = Future()
+    if owner:
+        try:
+            fut.set_result(_download_cover(url))
+        except BaseException as e:
+            # Don't cache failures; a later track may retry the same url
+            with _cover_lock:
+                _cover_futures.pop(url, None)
+            fut.set_exception(e)
+    return fut.result()
+
+
+def process_cover(url, output_path):
+    data = fetch_cover(url)
+    with open(output_path, "wb") as f:
+        f.write(data)
@@ -5,6 +5,7 @@ Menggunakan resolver engine untuk akurasi 95-100%
 
 import sys
 import os
+import threading
 sys.path.insert(0, os.path.dirname(__file__))
 
 from typing import Dict, List, Optional
@@ -24,6 +25,9 @@ except ImportError:
     YTMUSIC_AVAILABLE = False
     print("WARNING: ytmusicapi not available")
 
+# YTMusic clients per thread: keep-alive/TLS session dipakai ulang antar track
+_local = threading.local()
+
 class YTMusicResolver:
     """YouTube Music integration dengan Antigravity Resolver"""
     
@@ -222,6 +226,17 @@ class YTMusicResolver:
             if verbose: pass  # print(f"    [ERROR] Error converting result: {e}")
             return None
 
+def _get_resolver(auth_file: Optional[str], confidence_threshold: float) -> YTMusicResolver:
+    """Return this thread's YTMusicResolver for the given settings"""
+    resolvers = getattr(_local, "resolvers", None)
+    if resolvers is None:
+        resolvers = _local.resolvers = {}
+    key = (auth_file, confidence_threshold)
+    resolver = resolvers.get(key)
+    if resolver is None or resolver.ytmusic is None:
+        resolver = resolvers[key] = YTMusicResolver(auth_file, confidence_threshold)
+    return resolver
+
 # Convenience function
 def resolve_with_ytmusic(track: Dict, auth_file: Optional[str] = None, confidence_threshold: float = 0.85, verbose: bool = False) -> Optional[Dict]:
     """
@@ -240,8 +255,7 @@ def resolve_with_ytmusic(track: Dict, auth_file: Optional[str] = None, confidenc
         return None
     
     try:
-        resolver = YTMusicResolver(auth_file, confidence_threshold)
-        return resolver.resolve_track(track, verbose=verbose)
+        return _get_resolver(auth_file, confidence_threshold).resolve_track(track, verbose=verbose)
     except Exception as e:
         if verbose: pass  # print(f"[ERROR] Resolution failed: {e}")
         return None